@@ -7,23 +7,28 @@ import sys
 import json
 import asyncio
 import random
+import atexit
 import httpx
 import logging
 import sqlite3
 import argparse
-import functools
+import contextlib
 import dataclasses
 from math import floor
+from collections import OrderedDict
+from itertools import chain
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from typing import TYPE_CHECKING, Literal
 
+from aiolimiter import AsyncLimiter
 from dotenv import load_dotenv
 load_dotenv()
 
 from all_valve_employees import *
 
 if TYPE_CHECKING:
-	from typing import Iterable, TextIO
+	from typing import Iterable, Iterator, TextIO
 
 if sys.version_info >= (3, 12): # Thanks https://realpython.com/how-to-split-a-python-list-into-chunks/#custom-implementation-of-batched !
 	from itertools import batched
@@ -35,7 +40,18 @@ else:
 		while chunk := tuple(islice(iterator, chunk_size)):
 			yield chunk
 
-@dataclasses.dataclass
+try: # orjson is a lot faster at (de)serializing cached responses, but it's optional
+	import orjson
+
+	json_loads = orjson.loads
+
+	def json_dumps(value) -> str:
+		return orjson.dumps(value).decode()
+except ImportError:
+	json_loads = json.loads
+	json_dumps = json.dumps
+
+@dataclasses.dataclass(slots=True, frozen=True)
 class SteamProfile:
 	id: str
 	name: str
@@ -57,17 +73,48 @@ class Find:
 	previous_depth_find: Find | None = None
 
 	def get_related_steam_ids(self, include_previous_depths=True) -> list[str]:
-		steam_ids = [self.valve_dev_steam_id]
-		for steam_id_tally in self.steam_id_tallies:
-			for steam_id in steam_id_tally:
-				steam_ids.append(steam_id)
+		steam_ids = []
+
+		current_find = self
+		while current_find is not None:
+			steam_ids.append(current_find.valve_dev_steam_id)
+			for steam_id_tally in current_find.steam_id_tallies:
+				steam_ids.extend(steam_id_tally)
 
-		if include_previous_depths and self.previous_depth_find is not None:
-			for steam_id in self.previous_depth_find.get_related_steam_ids(include_previous_depths=include_previous_depths):
-				steam_ids.append(steam_id)
+			if not include_previous_depths:
+				break
+			current_find = current_find.previous_depth_find
 
 		return steam_ids
 
+# Chains of Steam IDs leading to someone are shared by everyone further down the same path,
+# so instead of copying them into new lists at each step, each link points back to the one before it: (steam_id, previous link)
+SteamIdChain = tuple[str, "SteamIdChain"] | None
+
+def iter_steam_id_chain(steam_id_chain: SteamIdChain) -> Iterator[str]: # from the last link to the first one
+	while steam_id_chain is not None:
+		steam_id, steam_id_chain = steam_id_chain
+		yield steam_id
+
+def steam_id_chain_to_list(steam_id_chain: SteamIdChain) -> list[str]:
+	steam_ids = list(iter_steam_id_chain(steam_id_chain))
+	steam_ids.reverse()
+	return steam_ids
+
+def get_friend_list_from_response(response_body: dict) -> list | None:
+	if "friendslist" in response_body:
+		return response_body["friendslist"]["friends"]
+	else: # private profile
+		return None
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class LazyJoin: # only joins when a log message using it actually gets formatted
+	separator: str
+	items: Iterable[str]
+
+	def __str__(self):
+		return self.separator.join(self.items)
+
 LOGGING_VERBOSITY_MAP = {
 	"critical": logging.CRITICAL,
 	"error": logging.ERROR,
@@ -76,15 +123,11 @@ LOGGING_VERBOSITY_MAP = {
 	"debug": logging.DEBUG
 }
 
-def flatten(value: list):
-	def _flatten(current: list, item: list):
-		if any(isinstance(item, typ) for typ in (list, set)):
-			current.extend(item)
-		else:
-			current.append(item)
-		return current
-
-	return list(functools.reduce(_flatten, value, []))
+def flatten(value: Iterable):
+	return list(chain.from_iterable(
+		item if isinstance(item, (list, set)) else (item,)
+		for item in value
+	))
 
 
 def parse_targets(value: list[str]):
@@ -93,16 +136,10 @@ def parse_targets(value: list[str]):
 		"OtherValveEmployees": all_public_valve_employees_steam_ids
 	}
 
-	value = [item.split(",") for item in value]
-	value = flatten(value)
-
-	for i, item in enumerate(value):
-		if item in special_values:
-			value[i] = special_values[item]
-
-	value = flatten(value)
-
-	return value
+	return flatten(
+		special_values.get(item, item)
+		for item in chain.from_iterable(item.split(",") for item in value)
+	)
 
 class LoadArgsFromFile(argparse.Action): # Thanks https://stackoverflow.com/a/27434050 !
 	def __call__(self, parser, namespace, values: Path, option_string=None):
@@ -120,6 +157,9 @@ class FindError(Exception):
 
 ROOT_PATH = Path(__file__, "../").resolve()
 
+DB_COMMIT_INTERVAL = 100 # friend lists inserted before committing them to disk
+FRIEND_LISTS_CACHE_SIZE = 1000 # most recently used friend lists kept in memory
+
 if __name__ == "__main__":
 	async def main():
 		argparser = argparse.ArgumentParser()
@@ -141,7 +181,7 @@ if __name__ == "__main__":
 		)
 		argparser.add_argument(
 			"--simultaneous_requests",
-			help="Number of requests per batch. Default: 2",
+			help="Number of requests in flight at once. Default: 2",
 			type=int,
 			default=2
 		)
@@ -154,7 +194,7 @@ if __name__ == "__main__":
 		argparser.add_argument(
 			"--request_delay",
 			type=float,
-			help="Time between request batches, in seconds. Default: 200 requests / 5 minutes (Steam recommended)",
+			help="Time between requests to the Steam API, in seconds. Default: 200 requests / 5 minutes (Steam recommended)",
 			default=200 / 5 / 60
 		)
 		argparser.add_argument(
@@ -183,7 +223,7 @@ if __name__ == "__main__":
 		)
 		args = argparser.parse_args()
 
-		target_steam_ids = parse_targets(args.targets)
+		target_steam_ids = frozenset(parse_targets(args.targets))
 
 		logging.basicConfig(
 			format="%(asctime)s %(levelname)s: %(message)s"
@@ -192,35 +232,222 @@ if __name__ == "__main__":
 		logger = logging.getLogger("gaben")
 		logger.setLevel(args.verbosity)
 
-		logger.debug(f"Running with arguments:\n{args._get_kwargs()!r}")
+		logger.debug("Running with arguments:\n%r", args._get_kwargs())
 
 
 		finds: dict[str, Find] = {}
+		visited_depths: dict[str, int] = {} # shallowest depth at which we've gone through someone's friends
+		# Who led us to each person whose friends we've gone through, at that depth. We only go through their friends for the first one,
+		# so chains through the rest are filled in from here once the search is over.
+		visited_parent_steam_ids: dict[tuple[str, int], list[str | None]] = {}
+
+		# Shared by every request, so they are spaced out globally no matter how many are in flight
+		steam_api_limiter = AsyncLimiter(1, args.request_delay) if args.request_delay > 0 else contextlib.nullcontext()
+		friend_lists_cache: OrderedDict[str, list | None] = OrderedDict() # parsed friend lists, so people we come across again don't hit the DB
+		friend_lists_in_flight: dict[str, asyncio.Task[tuple[bool, list | None]]] = {}
+
+		db = sqlite3.connect(args.db_file, autocommit=True, check_same_thread=False)
+		for pragma in (
+			"journal_mode=WAL",
+			"synchronous=NORMAL",
+			"cache_size=-65536", # 64MB
+			"temp_store=MEMORY",
+			"mmap_size=268435456" # 256MB
+		):
+			db.execute(f"PRAGMA {pragma}")
 
-		db = sqlite3.connect(args.db_file, autocommit=True)
+		for table, response_type in (("friend_lists", "BLOB"), ("profiles", "TEXT")):
+			db.execute(f"""
+			CREATE TABLE IF NOT EXISTS {table} (
+				steam_id TEXT PRIMARY KEY,
+				response {response_type}
+			)
+			""")
+
+			# Caches from before the tables were created here may not have a primary key (and may even have duplicate rows, so no UNIQUE).
+			# Those that do are already indexed by it, and a second index would only slow down inserts.
+			if any(column[1] == "steam_id" and column[5] > 0 for column in db.execute(f"PRAGMA table_info({table})")):
+				db.execute(f"DROP INDEX IF EXISTS idx_{table}_steam_id")
+			else:
+				db.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_steam_id ON {table}(steam_id)")
+
+		# Group inserts into transactions rather than paying for a commit (and fsync) on each of them.
+		# Whatever is left uncommitted gets flushed on exit, even if we bail out early.
+		db.autocommit = False
+		atexit.register(db.commit)
+
+		friend_lists_insert_cursor = db.cursor()
+		friend_lists_uncommitted_count = 0
+
+		# SQLite calls (and decoding what they return) block, so they run on their own thread while the event loop keeps the requests going.
+		# Just the one thread, so the connection is never used by two of them at the same time.
+		db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+		async def run_in_db_thread(func, *func_args):
+			return await asyncio.get_running_loop().run_in_executor(db_executor, func, *func_args)
+
+		def get_cached_friend_list(steam_id: str) -> tuple[bool, list | None]:
+			cached = db.execute(
+				"""
+				SELECT response
+					FROM friend_lists
+				WHERE
+					steam_id = ?
+				""",
+				(steam_id,)
+			).fetchone()
+
+			if cached is None:
+				return False, None
+
+			if cached[0] is None:
+				return True, None
+
+			cached_response = json_loads(cached[0])
+			if isinstance(cached_response, dict):
+				return True, get_friend_list_from_response(cached_response)
+			else: # older caches have just the friend list, rather than the whole response body
+				return True, cached_response
+
+		def insert_friend_list(steam_id: str, raw_response: bytes):
+			nonlocal friend_lists_uncommitted_count
+
+			friend_lists_insert_cursor.execute("""
+			INSERT INTO friend_lists (steam_id, response)
+			VALUES (?, ?)
+			""", (steam_id, raw_response))
+
+			friend_lists_uncommitted_count += 1
+			if friend_lists_uncommitted_count >= DB_COMMIT_INTERVAL:
+				db.commit()
+				friend_lists_uncommitted_count = 0
+
+		def insert_profiles(players: list[dict]):
+			db.executemany("""
+			INSERT INTO profiles (steam_id, response)
+			VALUES (?, ?)
+			""", ((profile_data["steamid"], json_dumps(profile_data)) for profile_data in players))
+			db.commit()
+
+		def cache_friend_list(steam_id: str, raw_friend_list: list | None):
+			friend_lists_cache[steam_id] = raw_friend_list
+			friend_lists_cache.move_to_end(steam_id)
+			if len(friend_lists_cache) > FRIEND_LISTS_CACHE_SIZE:
+				friend_lists_cache.popitem(last=False) # least recently used
+
+		async def get_friend_list(
+			client: httpx.AsyncClient,
+			steam_id: str,
+			*,
+			pretty_friends_left: str,
+			depth: int
+		) -> tuple[bool, list | None]:
+			response = None
+			try:
+				is_cached, raw_friend_list = await run_in_db_thread(get_cached_friend_list, steam_id)
+				if is_cached:
+					cache_friend_list(steam_id, raw_friend_list)
+				if is_cached or args.cached_only in ("all", "friends_only"):
+					return is_cached, raw_friend_list
+
+				errors_count = 0
+				while True:
+					if errors_count >= 5:
+						logger.error(f"Woah there, we've got {errors_count} errors from calling the Steam API")
+
+						# That's a lot of errors. Lets wait for the user to assess everything is fine, and whether we should continue or not.
+						# This blocks on purpose: everyone else should hold off until the user gets back to us.
+						if input("Make sure everything is fine from your side.\nAll good? Ok then, shall we continue? [y/N]: ").lower() != "y":
+							sys.exit(1)
+
+					logger.debug("Getting friends from Steam user with ID %s (%s) (depth=%d)", steam_id, pretty_friends_left, depth)
+
+					err = None
+					try:
+						async with steam_api_limiter:
+							response = await client.get("/ISteamUser/GetFriendList/v1", params={
+								"steamid": steam_id
+							})
+					except Exception as err2:
+						err = err2
+					else:
+						if response.status_code == 429 or floor(response.status_code / 100) == 5: # Too Many Requests or 5xx
+							# Steam API is funny, and might fail with Bad Gateway or Service Unavailable sometimes
+							err = response.status_code
+
+					if not err:
+						try:
+							response_body = json_loads(response.content)
+						except Exception as err2:
+							err = err2
+
+					if err:
+						match err:
+							case httpx.ConnectTimeout():
+								response_err_pretty = "Got a connection timeout"
+							case httpx.ReadTimeout():
+								response_err_pretty = "Got a read timeout"
+							case httpx.ReadError():
+								response_err_pretty = "Got a read error"
+							case 502:
+								response_err_pretty = "Received a Bad Gateway response"
+							case 503:
+								response_err_pretty = "Received a Bad Gateway response"
+							case 429:
+								response_err_pretty = "Got ratelimited"
+							case _:
+								response_err_pretty = f"Caught an error: {err!r}"
+
+						# lets wait a bit for it to recover, hopefully - and a bit longer each time it doesn't
+						retry_delay = min(5 * 2 ** errors_count, 5 * 60)
+						logger.debug("%s. Retrying in %d seconds...", response_err_pretty, retry_delay)
+						await asyncio.sleep(retry_delay)
+
+						errors_count += 1
+						continue # retry
+					else:
+						break
+
+				raw_friend_list = get_friend_list_from_response(response_body)
+
+				cache_friend_list(steam_id, raw_friend_list)
+				# Store the response body as we got it, rather than serializing the friend list we just parsed out of it back again
+				await run_in_db_thread(insert_friend_list, steam_id, response.content)
+
+				return False, raw_friend_list
+			except SystemExit as err:
+				raise err
+			except Exception as err:
+				raise FindError(steam_id, response) from err
 
 		async def find(
 			client: httpx.AsyncClient,
+			queue: asyncio.Queue[tuple[str, dict]],
 			steam_id: str,
 			*,
-			steam_ids_tally: list[str] = [],
+			steam_ids_chain: SteamIdChain = None,
 			depth: int = 0,
 			meta: dict = {}
 		):
-			nonlocal db, finds
+			nonlocal finds
 
 			response = None
 			try:
 				if steam_id in target_steam_ids:
 					previous_find = finds.get(steam_id, None)
+					steam_ids_tally = steam_id_chain_to_list(steam_ids_chain)
+					pretty_chain = LazyJoin(" → ", steam_ids_tally)
 
 					if steam_id == gaben_steam_id:
-						logger.info(f"Found Gaben (!) at depth={depth}\n\tCHAIN: {" → ".join(steam_ids_tally)})")
-						if not meta["previous_was_from_cache"]:
-							input("Hit enter to continue... ")
+						# Make sure it shows up the first time around, even with the default verbosity.
+						# (We used to wait for the user to hit enter here, but a prompt left open holds up exiting if something else fails meanwhile)
+						logger.log(
+							logging.INFO if meta["previous_was_from_cache"] else logging.WARNING,
+							"Found Gaben (!) at depth=%d\n\tCHAIN: %s)", depth, pretty_chain
+						)
 
 					if previous_find is None:
-						logger.info(f"Found (NEW!) Valve employee with ID {steam_id} at depth={depth}\n\tChain: {" → ".join(steam_ids_tally)})")
+						logger.info("Found (NEW!) Valve employee with ID %s at depth=%d\n\tChain: %s)", steam_id, depth, pretty_chain)
 
 						finds[steam_id] = Find(
 							valve_dev_steam_id=steam_id,
@@ -228,7 +455,7 @@ if __name__ == "__main__":
 							steam_id_tallies=[steam_ids_tally]
 						)
 					elif previous_find.depth > depth:
-						logger.info(f"Found Valve employee with ID {steam_id} at (NEW!) depth={depth} (prev. depth: {previous_find.depth})\n\tChain: {" → ".join(steam_ids_tally)})")
+						logger.info("Found Valve employee with ID %s at (NEW!) depth=%d (prev. depth: %d)\n\tChain: %s)", steam_id, depth, previous_find.depth, pretty_chain)
 
 						new_find = Find(
 							valve_dev_steam_id=steam_id,
@@ -238,106 +465,60 @@ if __name__ == "__main__":
 						new_find.previous_depth_find = previous_find
 						finds[steam_id] = new_find
 					else:
-						logger.info(f"Found (yet another instance of) Valve employee with ID {steam_id} at depth={depth} (found so far: {len(previous_find.steam_id_tallies) + 1})\n\tChain: {" → ".join(steam_ids_tally)})")
+						logger.info("Found (yet another instance of) Valve employee with ID %s at depth=%d (found so far: %d)\n\tChain: %s)", steam_id, depth, len(previous_find.steam_id_tallies) + 1, pretty_chain)
 
 						previous_find.steam_id_tallies.append(steam_ids_tally)
 
 				if depth >= args.max_depth:
 					return
 
+				# Going through their friends again from here can't find anyone closer than it did last time.
+				# If we got here just as quickly though, keep track of who led us here, so chains through them still get reported.
+				visited_depth = visited_depths.get(steam_id, args.max_depth)
+				parent_steam_id = steam_ids_chain[0] if steam_ids_chain is not None else None
+				if visited_depth == depth:
+					visited_parent_steam_ids[(steam_id, depth)].append(parent_steam_id)
+				if visited_depth <= depth:
+					return
+				visited_depths[steam_id] = depth
+				visited_parent_steam_ids[(steam_id, depth)] = [parent_steam_id]
+
 				pretty_friends_left = ""
-				pretty_friends_left_meta = meta
-				pretty_friends_left_i = 0
-				while "previous_meta" in pretty_friends_left_meta:
-					pretty_friends_left_i += 1
-					if pretty_friends_left_i > 1:
-						pretty_friends_left += ", "
-					pretty_friends_left += f"{pretty_friends_left_meta.get("friend_index", 0) + 1}/{pretty_friends_left_meta.get("previous_level_friends_length", 1)}"
-					pretty_friends_left_meta = pretty_friends_left_meta["previous_meta"]
-
-				cached = db.execute(
-					"""
-					SELECT response
-						FROM friend_lists
-					WHERE
-						steam_id = ?
-					""",
-					(steam_id,)
-				).fetchone()
-
-				if cached is not None:
-					logger.debug(f"Getting friends from Steam user with ID {steam_id} ({pretty_friends_left}) (depth={depth}) (cache hit)")
+				if logger.isEnabledFor(logging.DEBUG): # only shown in debug logs, no need to build it otherwise
+					pretty_friends_left_meta = meta
+					pretty_friends_left_i = 0
+					while "previous_meta" in pretty_friends_left_meta:
+						pretty_friends_left_i += 1
+						if pretty_friends_left_i > 1:
+							pretty_friends_left += ", "
+						pretty_friends_left += f"{pretty_friends_left_meta.get("friend_index", 0) + 1}/{pretty_friends_left_meta.get("previous_level_friends_length", 1)}"
+						pretty_friends_left_meta = pretty_friends_left_meta["previous_meta"]
+
+				if steam_id in friend_lists_cache:
+					friend_lists_cache.move_to_end(steam_id)
+					is_cached, raw_friend_list = True, friend_lists_cache[steam_id]
+				else:
+					# Someone else may be getting this same friend list right now, in which case we just wait for theirs
+					friend_list_task = friend_lists_in_flight.get(steam_id)
+					if friend_list_task is None:
+						friend_list_task = asyncio.create_task(get_friend_list(
+							client,
+							steam_id,
+							pretty_friends_left=pretty_friends_left,
+							depth=depth
+						))
+						friend_list_task.add_done_callback(lambda _task: friend_lists_in_flight.pop(steam_id, None))
+						friend_lists_in_flight[steam_id] = friend_list_task
+
+					is_cached, raw_friend_list = await friend_list_task
+
+				if is_cached:
+					logger.debug("Getting friends from Steam user with ID %s (%s) (depth=%d) (cache hit)", steam_id, pretty_friends_left, depth)
 
 					response = "<from cache>"
-
-					raw_friend_list = json.loads(cached[0]) if cached[0] is not None else None
 				elif args.cached_only in ("all", "friends_only"):
-					logger.debug(f"Getting friends from Steam user with ID {steam_id} ({pretty_friends_left}) (depth={depth}) (skipped because of --cached_only)")
+					logger.debug("Getting friends from Steam user with ID %s (%s) (depth=%d) (skipped because of --cached_only)", steam_id, pretty_friends_left, depth)
 					return
-				else:
-					errors_count = 0
-					while True:
-						if errors_count >= 5:
-							logger.error(f"Woah there, we've got {errors_count} errors from calling the Steam API")
-
-							# That's a lot of errors. Lets wait for the user to assess everything is fine, and whether we should continue or not.
-							if input("Make sure everything is fine from your side.\nAll good? Ok then, shall we continue? [y/N]: ").lower() != "y":
-								sys.exit(1)
-
-						logger.debug(f"Getting friends from Steam user with ID {steam_id} ({pretty_friends_left}) (depth={depth})")
-
-						await asyncio.sleep(args.request_delay)
-
-						err = None
-						try:
-							response = await client.get("/ISteamUser/GetFriendList/v1", params={
-								"steamid": steam_id
-							})
-						except Exception as err2:
-							err = err2
-						else:
-							if floor(response.status_code / 100) == 5: # 5xx
-								# Steam API is funny, and might fail with Bad Gateway or Service Unavailable sometimes
-								err = response.status_code
-
-						if not err:
-							try:
-								response_body = response.json()
-							except Exception as err2:
-								err = err2
-
-						if err:
-							match err:
-								case httpx.ConnectTimeout():
-									response_err_pretty = "Got a connection timeout"
-								case httpx.ReadTimeout():
-									response_err_pretty = "Got a read timeout"
-								case httpx.ReadError():
-									response_err_pretty = "Got a read error"
-								case 502:
-									response_err_pretty = "Received a Bad Gateway response"
-								case 503:
-									response_err_pretty = "Received a Bad Gateway response"
-								case _:
-									response_err_pretty = f"Caught an error: {err!r}"
-
-							logger.debug(f"{response_err_pretty}. Retrying in 5 seconds...")
-							await asyncio.sleep(5) # lets wait a bit for it to recover, hopefully
-
-							errors_count += 1
-							continue # retry
-						else:
-							break
-
-					if "friendslist" in response_body:
-						raw_friend_list = response_body["friendslist"]["friends"]
-					else:
-						raw_friend_list = None
-
-					db.execute("""
-					INSERT INTO friend_lists (steam_id, response)
-					VALUES (?, ?)
-					""", (steam_id, json.dumps(raw_friend_list)))
 
 				friends = [
 					friend
@@ -345,47 +526,40 @@ if __name__ == "__main__":
 					if (
 						friend["relationship"] == "friend" # not sure if there is any other relationship - but we only care about friends
 						and friend["steamid"] != steam_id # remove to avoid a recursive search (me → someone → me again)
-						and (len(steam_ids_tally) < 3 or steam_id not in steam_ids_tally) # we found this person again before (me → someone A → someone B → someone C → ... → someone α → someone A again)
 					)
 				] if raw_friend_list is not None else [] # ignore private profiles, I think... ?
 
 				if args.shuffle_friends:
 					random.shuffle(friends)
 
-				steam_ids_tally = [*steam_ids_tally, steam_id]
-				futures = [
-					find(
-						client,
+				steam_ids_chain = (steam_id, steam_ids_chain)
+				for friend_index, friend in enumerate(friends):
+					queue.put_nowait((
 						friend["steamid"],
-						steam_ids_tally=steam_ids_tally,
-						depth=depth + 1,
-						meta={
-							"friend_index": friend_index,
-							"previous_level_friends_length": len(friends),
-							"previous_meta": meta,
-							"previous_was_from_cache": cached is not None
+						{
+							"steam_ids_chain": steam_ids_chain,
+							"depth": depth + 1,
+							"meta": {
+								"friend_index": friend_index,
+								"previous_level_friends_length": len(friends),
+								"previous_meta": meta,
+								"previous_was_from_cache": is_cached
+							}
 						}
-					)
-					for friend_index, friend in enumerate(friends)
-				]
-
-				if len(futures) > 0:
-					for futures_chunk in batched(futures, args.simultaneous_requests):
-						done, _pending = await asyncio.wait([asyncio.create_task(future) for future in futures_chunk], return_when=asyncio.ALL_COMPLETED)
-
-						any_exception = False
-						for done_task in done:
-							if done_task.exception() is not None:
-								any_exception = True
-								logger.error("Uh oh", exc_info=done_task.exception())
-
-						if any_exception:
-							sys.exit(1)
-			except SystemExit as err:
+					))
+			except (SystemExit, FindError) as err:
 				raise err
 			except Exception as err:
 				raise FindError(steam_id, response) from err
 
+		async def find_worker(client: httpx.AsyncClient, queue: asyncio.Queue[tuple[str, dict]]):
+			while True:
+				steam_id, find_kwargs = await queue.get()
+				try:
+					await find(client, queue, steam_id, **find_kwargs)
+				finally:
+					queue.task_done()
+
 		async with httpx.AsyncClient(
 			base_url="https://api.steampowered.com",
 			params={
@@ -395,12 +569,65 @@ if __name__ == "__main__":
 				# Hopefully Valve will be a lot more merciful if they find this API spam and may think its malicious
 				"user-agent": "How Many Steam Friends Separate You From Gabe Newell? <https://youtu.be/ZokhvNPmNzs>"
 			},
-			limits=httpx.Limits(max_connections=args.simultaneous_requests, max_keepalive_connections=args.simultaneous_requests)
+			# Requests get multiplexed over HTTP/2 connections, so there is no need to keep one open per simultaneous request
+			http2=True,
+			limits=httpx.Limits(max_connections=64, max_keepalive_connections=16)
 		) as client:
-			await find(
-				client=client,
-				steam_id=str(args.initial_steam_id)
-			)
+			# Go through the friends graph breadth-first: a fixed pool of workers picks up whoever is next in line,
+			# so no branch has to wait for the slowest request of its siblings before going deeper.
+			find_queue: asyncio.Queue[tuple[str, dict]] = asyncio.Queue()
+			find_queue.put_nowait((str(args.initial_steam_id), {}))
+
+			find_workers = [
+				asyncio.create_task(find_worker(client, find_queue))
+				for _ in range(args.simultaneous_requests)
+			]
+			find_queue_done = asyncio.create_task(find_queue.join())
+
+			# Workers only ever stop by failing, so either everything got processed or something went wrong
+			await asyncio.wait([find_queue_done, *find_workers], return_when=asyncio.FIRST_COMPLETED)
+
+			# Friend lists still being fetched for the workers we are about to cancel; copied since they leave the dict as they finish
+			friend_list_tasks = [*friend_lists_in_flight.values()]
+
+			for task in (find_queue_done, *find_workers, *friend_list_tasks):
+				task.cancel()
+
+			any_exception = False
+			for result in await asyncio.gather(find_queue_done, *find_workers, return_exceptions=True):
+				if isinstance(result, BaseException) and not isinstance(result, asyncio.CancelledError):
+					any_exception = True
+					logger.error("Uh oh", exc_info=result)
+
+			# Their errors already reached the workers waiting on them
+			await asyncio.gather(*friend_list_tasks, return_exceptions=True)
+
+			if any_exception:
+				sys.exit(1)
+
+			def get_steam_id_tallies_to(steam_id: str, depth: int) -> list[list[str]]:
+				steam_id_tallies = []
+				for parent_steam_id in visited_parent_steam_ids[(steam_id, depth)]:
+					if parent_steam_id is None:
+						steam_id_tallies.append([steam_id])
+					else:
+						for steam_id_tally in get_steam_id_tallies_to(parent_steam_id, depth - 1):
+							steam_id_tallies.append([*steam_id_tally, steam_id])
+				return steam_id_tallies
+
+			# Finds only got the chain through whoever led us to each person first, add the ones through everyone else
+			for current_find in finds.values():
+				while current_find is not None:
+					current_find.steam_id_tallies = [
+						expanded_steam_id_tally
+						for steam_id_tally in current_find.steam_id_tallies
+						for expanded_steam_id_tally in (
+							get_steam_id_tallies_to(steam_id_tally[-1], len(steam_id_tally) - 1)
+							if len(steam_id_tally) > 0
+							else [steam_id_tally]
+						)
+					]
+					current_find = current_find.previous_depth_find
 
 			if len(finds) == 0:
 				logger.info(f"No connections to any Valve employees at depth {args.max_depth} :(")
@@ -417,58 +644,71 @@ if __name__ == "__main__":
 
 			unmapped_steam_ids: set[int] = set()
 			for current_find in finds.values():
-				for steam_id in current_find.get_related_steam_ids():
-					unmapped_steam_ids.add(steam_id)
+				unmapped_steam_ids.update(current_find.get_related_steam_ids())
 
 			logger.info(f"Retrieving {len(unmapped_steam_ids)} profiles...")
 
-			mapped_steam_profiles: dict[str, SteamProfile] = {}
-			for steam_id in { *unmapped_steam_ids }:
-				cached = db.execute(
-					"""
-					SELECT response
-						FROM profiles
-					WHERE
-						steam_id = ?
-					""",
-					(steam_id,)
-				).fetchone()
+			def get_cached_steam_profiles(steam_ids: set[str]) -> dict[str, SteamProfile]:
+				cached_steam_profiles: dict[str, SteamProfile] = {}
+
+				for steam_ids_chunk in batched(steam_ids, 500): # stay well under SQLite's limit of parameters per query
+					cached = db.execute(
+						f"""
+						SELECT steam_id, response
+							FROM profiles
+						WHERE
+							steam_id IN ({", ".join("?" * len(steam_ids_chunk))})
+						""",
+						steam_ids_chunk
+					)
+
+					for steam_id, response in cached:
+						profile_data = json_loads(response)
+
+						profile = SteamProfile.from_player_summaries_response(profile_data)
+						cached_steam_profiles[steam_id] = profile
 
-				if cached is not None:
-					profile_data = json.loads(cached[0])
+						logger.debug("Mapping %s: %s (cache hit)", steam_id, profile)
 
-					profile = SteamProfile.from_player_summaries_response(profile_data)
-					mapped_steam_profiles[steam_id] = profile
-					unmapped_steam_ids.remove(steam_id)
+				return cached_steam_profiles
 
-					logger.debug(f"Mapping {steam_id}: {profile} (cache hit)")
+			mapped_steam_profiles: dict[str, SteamProfile] = await run_in_db_thread(get_cached_steam_profiles, unmapped_steam_ids)
+			unmapped_steam_ids -= mapped_steam_profiles.keys()
 
 			if args.cached_only not in ("all", "profiles_only"):
-				for unmapped_steam_ids_chunk_idx, unmapped_steam_ids_chunk in enumerate(batched(unmapped_steam_ids, 100)): # up to 100 per request
-					await asyncio.sleep(args.request_delay)
+				profile_requests_semaphore = asyncio.Semaphore(args.simultaneous_requests)
+
+				async def map_steam_profiles(unmapped_steam_ids_chunk_idx: int, unmapped_steam_ids_chunk: tuple[str, ...]):
+					async with profile_requests_semaphore:
+						logger.debug(
+							"Getting profile data for... (%d/%d)\n\t%s",
+							unmapped_steam_ids_chunk_idx * 100,
+							len(unmapped_steam_ids),
+							LazyJoin(", ", unmapped_steam_ids_chunk)
+						)
+						async with steam_api_limiter:
+							response_body = (await client.get("/ISteamUser/GetPlayerSummaries/v2", params={
+								"steamids": ",".join(unmapped_steam_ids_chunk)
+							})).json()
 
-					logger.debug(
-						f"Getting profile data for... ({unmapped_steam_ids_chunk_idx * len(unmapped_steam_ids)}/{len(unmapped_steam_ids)})\n" +
-						f"\t{", ".join(unmapped_steam_ids_chunk)}"
-					)
-					response_body = (await client.get("/ISteamUser/GetPlayerSummaries/v2", params={
-						"steamids": ",".join(unmapped_steam_ids_chunk)
-					})).json()
+					players = response_body["response"]["players"]
 
-					for profile_data in response_body["response"]["players"]:
-						steam_id = profile_data["steamid"]
+					await run_in_db_thread(insert_profiles, players)
 
-						db.execute("""
-						INSERT INTO profiles (steam_id, response)
-						VALUES (?, ?)
-						""", (steam_id, json.dumps(profile_data)))
+					for profile_data in players:
+						steam_id = profile_data["steamid"]
 
 						profile = SteamProfile.from_player_summaries_response(profile_data)
 						mapped_steam_profiles[steam_id] = profile
 
-						logger.debug(f"Mapping {steam_id}: {profile}")
+						logger.debug("Mapping %s: %s", steam_id, profile)
+
+				await asyncio.gather(*(
+					map_steam_profiles(unmapped_steam_ids_chunk_idx, unmapped_steam_ids_chunk)
+					for unmapped_steam_ids_chunk_idx, unmapped_steam_ids_chunk in enumerate(batched(unmapped_steam_ids, 100)) # up to 100 per request
+				))
 			else:
-				logger.debug(f"Getting remaining profile data ({len(unmapped_steam_ids)} entries) skipped due to --cached_only")
+				logger.debug("Getting remaining profile data (%d entries) skipped due to --cached_only", len(unmapped_steam_ids))
 
 			logger.info("Finally...")
 
@@ -493,4 +733,9 @@ if __name__ == "__main__":
 				logger.info(f"Found {valve_dev_identifier} at depth={current_find.depth}.\n{chains_pretty}")
 
 
-	asyncio.run(main())
+	try: # uvloop has a faster event loop than asyncio's default, but it's optional
+		import uvloop
+	except ImportError:
+		asyncio.run(main())
+	else:
+		asyncio.run(main(), loop_factory=uvloop.new_event_loop)